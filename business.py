@@ -3,6 +3,9 @@ import os
 import json
 from telethon import TelegramClient
 from telethon.errors import FloodWaitError
+from storage import ExportStore
+from stats import ChatStats
+from reader import ExportReader
 
 def load_config(config_file="config.json"):
     print(f"Загрузка конфигурации из {config_file}...")
@@ -14,7 +17,9 @@ def load_config(config_file="config.json"):
         "messages_limit": 200,
         "batch_delay": 1.0,
         "chat_delay": 5,
-        "exported_chats_file": "exported_chats.json"
+        "exported_chats_file": "exported_chats.json",
+        "commit_batch_size": 20,
+        "export_stats": True
     }
     if not os.path.exists(config_file):
         print(f"Файл {config_file} не найден, создаём с значениями по умолчанию.")
@@ -47,6 +52,8 @@ MESSAGES_LIMIT = CONFIG.get("messages_limit")
 BATCH_DELAY = CONFIG.get("batch_delay")
 CHAT_DELAY = CONFIG.get("chat_delay")
 EXPORTED_CHATS_FILE = CONFIG.get("exported_chats_file")
+COMMIT_BATCH_SIZE = CONFIG.get("commit_batch_size")
+EXPORT_STATS = CONFIG.get("export_stats")
 
 class TelegramExporter:
     def __init__(self, api_id=API_ID, api_hash=API_HASH, session_name=SESSION_NAME):
@@ -56,18 +63,26 @@ class TelegramExporter:
         self.client = None
         self.semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHATS)
         self.exported_chats = {}  # Очередь пуста при старте
+        self.store = ExportStore(EXPORTED_CHATS_FILE)
+        self.store.recover()
+        self.chat_stats = {}  # file_path -> ChatStats, загружается при первом экспорте
         self.running = False
         self.loop = None
 
     def save_exported_chats(self):
         print(f"Сохранение данных о {len(self.exported_chats)} чатах в {EXPORTED_CHATS_FILE}...")
         try:
-            with open(EXPORTED_CHATS_FILE, "w", encoding="utf-8") as f:
-                json.dump(self.exported_chats, f, ensure_ascii=False, indent=4)
+            self.store.save_state(self.exported_chats)
             print("Данные успешно сохранены.")
         except Exception as e:
             print(f"Ошибка сохранения {EXPORTED_CHATS_FILE}: {e}")
 
+    def commit_exported_chats(self):
+        try:
+            self.store.commit(self.exported_chats)
+        except Exception as e:
+            print(f"Ошибка фиксации экспорта: {type(e).__name__}: {e}")
+
     async def connect(self, phone_callback, code_callback, password_callback=None):
         print("Подключение к Telegram...")
         self.client = TelegramClient(self.session_name, self.api_id, self.api_hash)
@@ -119,24 +134,18 @@ class TelegramExporter:
             print(f"Файл {file_path} не существует.")
             return None, None
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                lines = f.readlines()
-                if not lines:
-                    print(f"Файл {file_path} пуст.")
+            with ExportReader(file_path) as reader:
+                message = reader.first()
+                if message is None:
+                    print(f"Некорректный формат файла {file_path} или файл пуст.")
                     return None, None
-                first_line = lines[0].strip()
-                if first_line.startswith("### Message"):  # Markdown
-                    msg_id = int(first_line.split("### Message")[1].strip())
-                    msg_text = lines[4].strip() if len(lines) > 4 else ""
-                elif first_line.startswith("MSGID:"):  # TXT
-                    parts = first_line.split("|", 1)
-                    msg_id = int(parts[0].replace("MSGID:", "").strip())
-                    msg_text = parts[1].strip() if len(parts) > 1 else ""
+                if reader.output_format == "md":
+                    msg_text = message.text
                 else:
-                    print(f"Некорректный формат файла {file_path}.")
-                    return None, None
-                print(f"Найдено последнее сообщение: ID={msg_id}, текст='{msg_text}'.")
-                return msg_id, msg_text
+                    # В состоянии для txt хранится всё, что после "|" в строке сообщения.
+                    msg_text = f"[{message.date}] (ID {message.sender}): {message.text}".strip()
+            print(f"Найдено последнее сообщение: ID={message.id}, текст='{msg_text}'.")
+            return message.id, msg_text
         except Exception as e:
             print(f"Ошибка чтения файла {file_path}: {e}")
             return None, None
@@ -148,15 +157,24 @@ class TelegramExporter:
             print(f"Клиент не подключён для чата {chat_id}, попытка переподключения...")
             await self.client.connect()
 
+        if file_path in self.store.pending:
+            # Состояние чата меняется только при фиксации, поэтому до неё
+            # повторная выгрузка взяла бы те же сообщения второй раз.
+            self.commit_exported_chats()
+            if file_path in self.store.pending:
+                print(f"Предыдущая запись {file_path} ещё не зафиксирована, чат пропущен.")
+                return
+
         chat_key = str(chat_id)
         chat_data = self.exported_chats.get(chat_key, {})
         last_id = chat_data.get("last_message_id", 0)
-        last_text = chat_data.get("last_message_text", "")
 
-        file_last_id, file_last_text = self.get_last_message_from_file(file_path)
-        if file_last_id == last_id and file_last_text == last_text and last_id > 0:
-            print(f"Чат {chat_id} уже обновлён, новых сообщений нет.")
-            return
+        # Совпадение файла и состояния не говорит, есть ли новые сообщения на сервере,
+        # поэтому сравнение нужно только чтобы заметить расхождение: тогда верим файлу.
+        file_last_id, _ = self.get_last_message_from_file(file_path)
+        if file_last_id is not None and file_last_id != last_id:
+            print(f"Состояние чата {chat_id} (ID={last_id}) расходится с файлом (ID={file_last_id}), продолжаем от файла.")
+            last_id = file_last_id
 
         messages = []
         max_id = last_id
@@ -191,38 +209,44 @@ class TelegramExporter:
                     os.makedirs(directory, exist_ok=True)
                     print(f"Директория {directory} успешно создана.")
 
-                if os.path.exists(file_path):
-                    with open(file_path, "r", encoding="utf-8") as f:
-                        old_content = f.read()
-                else:
-                    old_content = ""
-
+                last_message_text = messages[0].split("|", 1)[1].strip() if output_format == "txt" else chat_messages[0].message or ""
+                chat_state = {
+                    "chat_id": chat_id,
+                    "file_path": file_path,
+                    "last_message_id": max_id,
+                    "last_message_text": last_message_text
+                }
                 try:
-                    print(f"Открытие файла {file_path} для записи...")
-                    with open(file_path, "w", encoding="utf-8") as f:
-                        print(f"Запись данных в файл {file_path}...")
-                        f.write("".join(messages))
-                        f.write(old_content)
-                    print(f"Файл {file_path} успешно записан.")
-                    last_message_text = messages[0].split("|", 1)[1].strip() if output_format == "txt" else chat_messages[0].message or ""
+                    print(f"Запись данных во временный файл для {file_path}...")
+                    self.store.stage(chat_key, file_path, "".join(messages), chat_state)
+                    print(f"Файл {file_path} подготовлен, ожидает фиксации.")
                 except Exception as e:
                     print(f"Ошибка при записи в файл {file_path}: {type(e).__name__}: {e}")
                     return
+                if EXPORT_STATS:
+                    try:
+                        self.update_chat_stats(file_path, chat_messages)
+                    except Exception as e:
+                        # Экспорт уже подготовлен; статистика догонит его при следующей загрузке.
+                        self.chat_stats.pop(file_path, None)
+                        print(f"Ошибка обновления статистики {file_path}: {type(e).__name__}: {e}")
+                if len(self.store.pending) >= COMMIT_BATCH_SIZE:
+                    self.commit_exported_chats()
             else:
                 print(f"Новых сообщений для чата {chat_id} нет.")
-                last_message_text = last_text
-
-            self.exported_chats[chat_key] = {
-                "chat_id": chat_id,
-                "file_path": file_path,
-                "last_message_id": max_id,
-                "last_message_text": last_message_text
-            }
-            self.save_exported_chats()
 
         print(f"Экспорт чата {chat_id} завершён, последний ID={max_id}. Ожидание {CHAT_DELAY} сек...")
         await asyncio.sleep(CHAT_DELAY)
 
+    def update_chat_stats(self, file_path, chat_messages):
+        stats = self.chat_stats.get(file_path)
+        if stats is None:
+            stats = ChatStats.load(file_path)
+            self.chat_stats[file_path] = stats
+        added = stats.update(chat_messages)
+        print(f"Статистика чата обновлена: +{added} сообщений, всего {stats.rows}.")
+        stats.stage(self.store)
+
     async def export_queue(self):
         self.running = True
         while self.running:
@@ -236,6 +260,7 @@ class TelegramExporter:
                 file_path = self.exported_chats[chat_id_str]["file_path"]
                 output_format = "md" if file_path.endswith(".md") else "txt"
                 await self.export_chat(chat_id, file_path, output_format)
+            self.commit_exported_chats()
             if self.running and self.exported_chats:
                 print("Очередь обработана, начинаем заново...")
             await asyncio.sleep(1)
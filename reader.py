@@ -0,0 +1,190 @@
+import os
+import re
+import mmap
+from collections import namedtuple
+from datetime import date, datetime, timezone
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# date и sender — строки в том виде, в каком их записал export_chat
+# ("UnknownDate", "UnknownSender" тоже возможны), offset — смещение сообщения в файле.
+ExportedMessage = namedtuple("ExportedMessage", ["id", "date", "sender", "text", "offset"])
+
+FORMATS = {
+    "txt": {
+        "marker": b"\nMSGID: ",
+        "header": re.compile(rb"MSGID: (\d+) \| \[([^\]\r\n]*)\] \(ID ([^)\r\n]*)\): "),
+        "tail": re.compile(rb"\r?\n\Z"),
+    },
+    "md": {
+        "marker": b"\n### Message ",
+        "header": re.compile(rb"### Message (\d+)\r?\n\*\*Date:\*\* ([^\r\n]*)  \r?\n\*\*Sender:\*\* ([^\r\n]*)\r?\n\r?\n"),
+        "tail": re.compile(rb"\r?\n\r?\n---\r?\n\Z"),
+    },
+}
+
+
+def parse_date(value):
+    # Для сравнения достаточно строк: формат даты экспорта сортируется лексикографически,
+    # а date_to вида "2024-01-31" (или datetime.date) включает весь день.
+    # Даты в экспорте в UTC, поэтому datetime с часовым поясом переводится в UTC.
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        return value.strftime(DATE_FORMAT)
+    if isinstance(value, date):
+        return value.strftime('%Y-%m-%d')
+    return value
+
+
+class ExportReader:
+    # Ленивое чтение txt/md экспортов через mmap без загрузки файла целиком.
+    # export_chat дописывает новые сообщения в начало, поэтому id в файле убывают
+    # и поиск по id — бинарный поиск по смещениям с выравниванием на начало сообщения.
+    # Фильтры по дате предполагают, что даты в Telegram растут вместе с id:
+    # date_to ищется тем же бинарным поиском, а перебор останавливается на первом
+    # сообщении раньше date_from. Если порядок дат нарушен (например, в файл
+    # вручную вставлены сообщения), часть подходящих сообщений будет пропущена.
+
+    def __init__(self, file_path, output_format=None):
+        self.file_path = os.path.normpath(file_path)
+        self.file = open(self.file_path, "rb")
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+        if output_format is None:
+            output_format = "md" if self.data[:12] == b"### Message " else "txt"
+        if output_format not in FORMATS:
+            self.close()
+            raise ValueError(f"Неизвестный формат экспорта: {output_format}")
+        self.output_format = output_format
+        self.marker = FORMATS[output_format]["marker"]
+        self.header = FORMATS[output_format]["header"]
+        self.tail = FORMATS[output_format]["tail"]
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        return self.iter_messages()
+
+    def next_boundary(self, pos):
+        # Начало первого сообщения, которое начинается не раньше pos, иначе size.
+        if pos == 0 and self.header.match(self.data, 0):
+            return 0
+        search_from = max(pos - 1, 0)
+        while True:
+            i = self.data.find(self.marker, search_from)
+            if i < 0:
+                return self.size
+            if self.header.match(self.data, i + 1):
+                return i + 1
+            # Строка текста, похожая на заголовок, но им не являющаяся.
+            search_from = i + 1
+
+    def message_at(self, start):
+        header = self.header.match(self.data, start)
+        end = self.next_boundary(header.end())
+        text = self.data[header.end():end]
+        text = self.tail.sub(b"", text).decode("utf-8").replace("\r\n", "\n")
+        message = ExportedMessage(
+            int(header.group(1)),
+            header.group(2).decode("utf-8"),
+            header.group(3).decode("utf-8"),
+            text,
+            start
+        )
+        return message, end
+
+    def id_at(self, start):
+        return int(self.header.match(self.data, start).group(1))
+
+    def date_at(self, start):
+        return self.header.match(self.data, start).group(2).decode("utf-8")
+
+    def seek(self, is_newer):
+        # Смещение первого сообщения, для которого is_newer(start) ложно.
+        # Предикат должен быть монотонным по файлу: сначала истина, потом ложь.
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self.next_boundary(mid)
+            if start < self.size and is_newer(start):
+                lo = start + 1
+            else:
+                hi = mid
+        return self.next_boundary(lo)
+
+    def seek_id(self, message_id):
+        # Первое сообщение с id <= message_id (id в файле убывают).
+        return self.seek(lambda start: self.id_at(start) > message_id)
+
+    def seek_date(self, date_to):
+        # Первое сообщение не позже date_to; сообщения с "UnknownDate" не пропускаются.
+        def is_newer(start):
+            date = self.date_at(start)
+            return date != "UnknownDate" and date[:len(date_to)] > date_to
+        return self.seek(is_newer)
+
+    def iter_messages(self, min_id=None, max_id=None, date_from=None, date_to=None):
+        date_from = parse_date(date_from)
+        date_to = parse_date(date_to)
+        pos = self.next_boundary(0)
+        if max_id is not None:
+            pos = max(pos, self.seek_id(max_id))
+        if date_to is not None:
+            pos = max(pos, self.seek_date(date_to))
+        while pos < self.size:
+            message, pos = self.message_at(pos)
+            if min_id is not None and message.id < min_id:
+                break
+            if date_from is not None or date_to is not None:
+                if message.date == "UnknownDate":
+                    continue
+                if date_to is not None and message.date[:len(date_to)] > date_to:
+                    continue
+                if date_from is not None and message.date < date_from:
+                    break
+            yield message
+
+    def get(self, message_id):
+        start = self.seek_id(message_id)
+        if start < self.size and self.id_at(start) == message_id:
+            return self.message_at(start)[0]
+        return None
+
+    def first(self):
+        start = self.next_boundary(0)
+        if start < self.size:
+            return self.message_at(start)[0]
+        return None
+
+    def last(self):
+        # Самое старое сообщение: ищем последний настоящий заголовок с конца файла.
+        start = self.size
+        end = self.size
+        while end > 0:
+            i = self.data.rfind(self.marker, 0, end)
+            if i < 0:
+                if self.header.match(self.data, 0):
+                    start = 0
+                break
+            if self.header.match(self.data, i + 1):
+                start = i + 1
+                break
+            end = i
+        if start < self.size:
+            return self.message_at(start)[0]
+        return None
+
+
+def read_messages(file_path, **filters):
+    with ExportReader(file_path) as reader:
+        yield from reader.iter_messages(**filters)
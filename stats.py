@@ -0,0 +1,208 @@
+import os
+import json
+from array import array
+from datetime import datetime, timezone
+
+from reader import ExportReader, DATE_FORMAT
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+COLUMNS = ("id", "date", "sender_id", "length")
+
+
+def stats_path(file_path):
+    return file_path + ".stats.json"
+
+
+def columns_dir(file_path):
+    return file_path + ".columns"
+
+
+def column_path(file_path, name):
+    return os.path.join(columns_dir(file_path), f"{name}.bin")
+
+
+def length_bucket(length):
+    # Корзина i содержит длины из [2**(i-1), 2**i), корзина 0 — пустые сообщения.
+    return length.bit_length()
+
+
+class ChatStats:
+    # Агрегаты по чату, которые обновляются только новыми сообщениями каждого цикла.
+    # Если статистики нет или она отстаёт от экспорта (экспорт старше статистики,
+    # она была отключена или не прочиталась), load() один раз дочитывает
+    # недостающее из самого файла экспорта. Покрытый диапазон id хранится в
+    # first_message_id/last_message_id.
+    # Колонки (id, date, sender_id, length) дописываются в .columns/*.bin как int64,
+    # а число зафиксированных строк хранится в .stats.json и фиксируется вместе
+    # с экспортом, поэтому хвост, дописанный до сбоя, отрезается при загрузке.
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.reset()
+
+    def reset(self):
+        self.first_message_id = 0
+        self.last_message_id = 0
+        self.rows = 0
+        self.per_day = {}
+        self.per_sender = {}
+        self.heatmap = [[0] * 24 for _ in range(7)]  # день недели x час
+        self.length_histogram = []
+        self.new_columns = {name: array("q") for name in COLUMNS}
+
+    @classmethod
+    def load(cls, file_path):
+        stats = cls(file_path)
+        path = stats_path(file_path)
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                stats.first_message_id = data["first_message_id"]
+                stats.last_message_id = data["last_message_id"]
+                stats.rows = data["rows"]
+                stats.per_day = data["per_day"]
+                stats.per_sender = data["per_sender"]
+                stats.heatmap = data["heatmap"]
+                stats.length_histogram = data["length_histogram"]
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Ошибка чтения статистики {path}: {e}, статистика будет пересчитана по экспорту.")
+                stats.reset()
+        if not stats.columns_complete():
+            # Колонки удалены или обрезаны — дописывать к ним нельзя, пересчитываем.
+            print(f"Колонки статистики {columns_dir(file_path)} неполные, статистика будет пересчитана по экспорту.")
+            stats.reset()
+        stats.truncate_columns()
+        stats.backfill()
+        return stats
+
+    def backfill(self):
+        export_first_id = export_last_id = 0
+        if os.path.exists(self.file_path):
+            with ExportReader(self.file_path) as reader:
+                newest, oldest = reader.first(), reader.last()
+                if newest and oldest:
+                    export_first_id, export_last_id = oldest.id, newest.id
+        if self.last_message_id > export_last_id or (self.rows and export_first_id < self.first_message_id):
+            # Экспорт заменён или статистика не покрывает его начало — пересчёт целиком.
+            print(f"Статистика {self.file_path} не соответствует экспорту, пересчёт заново.")
+            self.reset()
+            self.truncate_columns()
+        if self.last_message_id == export_last_id:
+            return
+        print(f"Дочитывание статистики из {self.file_path} после ID={self.last_message_id}...")
+        # Экспорт идёт от новых к старым, а колонки пишутся по возрастанию id,
+        # поэтому сначала собираем компактные колонки, затем переворачиваем.
+        rows = {name: array("q") for name in COLUMNS}
+        with ExportReader(self.file_path) as reader:
+            for message in reader.iter_messages(min_id=self.last_message_id + 1):
+                if message.date == "UnknownDate":
+                    timestamp = 0
+                else:
+                    date = datetime.strptime(message.date, DATE_FORMAT).replace(tzinfo=timezone.utc)
+                    timestamp = int(date.timestamp())
+                rows["id"].append(message.id)
+                rows["date"].append(timestamp)
+                rows["sender_id"].append(int(message.sender) if message.sender.lstrip("-").isdigit() else 0)
+                rows["length"].append(len(message.text))
+        for column in rows.values():
+            column.reverse()
+        for i in range(len(rows["id"])):
+            date = datetime.fromtimestamp(rows["date"][i], timezone.utc) if rows["date"][i] else None
+            self.add(rows["id"][i], date, rows["sender_id"][i], rows["length"][i])
+        print(f"Статистика дочитана: +{len(rows['id'])} сообщений.")
+
+    def columns_complete(self):
+        size = self.rows * array("q").itemsize
+        for name in COLUMNS:
+            path = column_path(self.file_path, name)
+            if size and (not os.path.exists(path) or os.path.getsize(path) < size):
+                return False
+        return True
+
+    def truncate_columns(self):
+        size = self.rows * array("q").itemsize
+        for name in COLUMNS:
+            path = column_path(self.file_path, name)
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+
+    def update(self, messages):
+        new_messages = sorted(
+            (m for m in messages if m.id > self.last_message_id), key=lambda m: m.id
+        )
+        for message in new_messages:
+            self.add(message.id, message.date, message.sender_id or 0, len(message.message or ""))
+        return len(new_messages)
+
+    def add(self, message_id, date, sender_id, length):
+        if date:
+            day = date.strftime('%Y-%m-%d')
+            self.heatmap[date.weekday()][date.hour] += 1
+            timestamp = int(date.timestamp())
+        else:
+            day = "UnknownDate"
+            timestamp = 0
+        self.per_day[day] = self.per_day.get(day, 0) + 1
+        sender_key = str(sender_id) if sender_id else "UnknownSender"
+        self.per_sender[sender_key] = self.per_sender.get(sender_key, 0) + 1
+        bucket = length_bucket(length)
+        if bucket >= len(self.length_histogram):
+            self.length_histogram.extend([0] * (bucket + 1 - len(self.length_histogram)))
+        self.length_histogram[bucket] += 1
+
+        self.new_columns["id"].append(message_id)
+        self.new_columns["date"].append(timestamp)
+        self.new_columns["sender_id"].append(sender_id)
+        self.new_columns["length"].append(length)
+        if not self.first_message_id:
+            self.first_message_id = message_id
+        self.last_message_id = message_id
+        self.rows += 1
+
+    def to_dict(self):
+        return {
+            "first_message_id": self.first_message_id,
+            "last_message_id": self.last_message_id,
+            "rows": self.rows,
+            "per_day": self.per_day,
+            "per_sender": self.per_sender,
+            "heatmap": self.heatmap,
+            "length_histogram": self.length_histogram
+        }
+
+    def stage(self, store):
+        os.makedirs(columns_dir(self.file_path), exist_ok=True)
+        # Буферы сбрасываются только после успешной записи всех колонок,
+        # поэтому на диске до них ровно rows - len(буфера) строк.
+        offset = (self.rows - len(self.new_columns["id"])) * array("q").itemsize
+        for name in COLUMNS:
+            if self.new_columns[name]:
+                store.stage_append(column_path(self.file_path, name), self.new_columns[name].tobytes(), offset)
+        store.stage_replace(stats_path(self.file_path), json.dumps(self.to_dict(), ensure_ascii=False, indent=4))
+        self.new_columns = {name: array("q") for name in COLUMNS}
+
+
+def load_columns(file_path):
+    # Колонки экспорта для векторного анализа: numpy.ndarray, если NumPy установлен,
+    # иначе array.array. Читаются только зафиксированные строки.
+    file_path = os.path.normpath(file_path)
+    with open(stats_path(file_path), "r", encoding="utf-8") as f:
+        rows = json.load(f)["rows"]
+    columns = {}
+    for name in COLUMNS:
+        path = column_path(file_path, name)
+        if numpy is not None:
+            columns[name] = numpy.fromfile(path, dtype=numpy.int64, count=rows) if rows else numpy.zeros(0, dtype=numpy.int64)
+        else:
+            column = array("q")
+            if rows:
+                with open(path, "rb") as f:
+                    column.frombytes(f.read(rows * column.itemsize))
+            columns[name] = column
+    return columns
@@ -0,0 +1,155 @@
+import os
+import json
+import shutil
+import threading
+
+
+def fsync_directory(directory):
+    # Фиксируем на диске саму запись каталога (создание/переименование файла).
+    # На Windows каталог так открыть нельзя — там rename и так журналируется ФС.
+    try:
+        fd = os.open(directory or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def fsync_file(file_path):
+    with open(file_path, "rb+") as f:
+        os.fsync(f.fileno())
+
+
+def write_json_durable(file_path, data):
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+    fsync_directory(os.path.dirname(os.path.abspath(file_path)))
+
+
+class ExportStore:
+    # Групповая фиксация файлов экспорта вместе с состоянием чатов.
+    # Новые сообщения пишутся во временный файл рядом с экспортом, без fsync.
+    # commit() за один проход делает fsync всех временных файлов, пишет журнал
+    # (точка фиксации), переименовывает файлы и сохраняет состояние. После сбоя
+    # recover() доводит до конца фиксацию из журнала; незафиксированные
+    # временные файлы игнорируются и перезаписываются при следующем экспорте.
+    # Сопутствующие файлы (статистика чата) фиксируются в том же журнале.
+
+    def __init__(self, state_file):
+        self.state_file = state_file
+        self.journal_file = state_file + ".journal"
+        self.pending = {}  # file_path -> (tmp_path, chat_key, chat_state)
+        self.replaced = {}  # file_path -> tmp_path, сопутствующие файлы целиком
+        self.appended = set()  # файлы, дописанные с конца, нужен только fsync
+        self.lock = threading.Lock()
+
+    def recover(self):
+        if not os.path.exists(self.journal_file):
+            return
+        print(f"Найден журнал {self.journal_file}, восстановление незавершённой записи...")
+        try:
+            with open(self.journal_file, "r", encoding="utf-8") as f:
+                journal = json.load(f)
+        except (OSError, ValueError) as e:
+            # Журнал не дописан — фиксация не состоялась, файлы и состояние не тронуты.
+            print(f"Журнал повреждён ({e}), незавершённая запись отброшена.")
+            os.remove(self.journal_file)
+            return
+        with self.lock:
+            self._apply_journal(journal)
+        print("Восстановление завершено.")
+
+    def save_state(self, exported_chats):
+        with self.lock:
+            write_json_durable(self.state_file, dict(exported_chats))
+
+    def stage(self, chat_key, file_path, new_content, chat_state):
+        if file_path in self.pending:
+            raise ValueError(f"Файл {file_path} уже ждёт фиксации")
+        tmp_path = file_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(new_content)
+            if os.path.exists(file_path):
+                with open(file_path, "r", encoding="utf-8") as old:
+                    shutil.copyfileobj(old, f)
+        self.pending[file_path] = (tmp_path, chat_key, chat_state)
+
+    def stage_replace(self, file_path, content):
+        tmp_path = file_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        self.replaced[file_path] = tmp_path
+
+    def stage_append(self, file_path, data, offset):
+        # Запись идёт строго с offset: хвост от неудачной попытки отрезается,
+        # поэтому повтор не дублирует данные.
+        with open(file_path, "ab") as f:
+            f.truncate(offset)
+            f.write(data)
+        self.appended.add(file_path)
+
+    def commit(self, exported_chats):
+        if not self.pending and not self.replaced:
+            return
+        print(f"Фиксация {len(self.pending)} файлов экспорта и состояния чатов...")
+        with self.lock:
+            directories = set()
+            renames = []
+            # Новое состояние собираем в копии: живой словарь меняется только
+            # после успешной фиксации, иначе save_exported_chats сохранил бы
+            # last_message_id, которых нет в файлах на диске.
+            state = dict(exported_chats)
+            updates = {}
+            for file_path, (tmp_path, chat_key, chat_state) in self.pending.items():
+                # Если прошлая фиксация упала уже после переименования,
+                # временного файла нет и синхронизировать нужно сам файл.
+                fsync_file(tmp_path if os.path.exists(tmp_path) else file_path)
+                directories.add(os.path.dirname(os.path.abspath(file_path)))
+                renames.append([tmp_path, file_path])
+                # Чат могли убрать из очереди, пока запись ждала фиксации.
+                if chat_key in state:
+                    state[chat_key] = chat_state
+                    updates[chat_key] = chat_state
+            for file_path, tmp_path in self.replaced.items():
+                fsync_file(tmp_path if os.path.exists(tmp_path) else file_path)
+                directories.add(os.path.dirname(os.path.abspath(file_path)))
+                renames.append([tmp_path, file_path])
+            for file_path in self.appended:
+                fsync_file(file_path)
+                directories.add(os.path.dirname(os.path.abspath(file_path)))
+
+            journal = {"renames": renames, "state": state}
+            with open(self.journal_file, "w", encoding="utf-8") as f:
+                json.dump(journal, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            fsync_directory(os.path.dirname(os.path.abspath(self.journal_file)))
+
+            self._apply_journal(journal, directories)
+            for chat_key, chat_state in updates.items():
+                if chat_key in exported_chats:
+                    exported_chats[chat_key] = chat_state
+            self.pending.clear()
+            self.replaced.clear()
+            self.appended.clear()
+        print("Фиксация завершена.")
+
+    def _apply_journal(self, journal, directories=None):
+        if directories is None:
+            directories = {os.path.dirname(os.path.abspath(target)) for _, target in journal["renames"]}
+        for tmp_path, file_path in journal["renames"]:
+            if os.path.exists(tmp_path):
+                os.replace(tmp_path, file_path)
+        for directory in directories:
+            fsync_directory(directory)
+        write_json_durable(self.state_file, journal["state"])
+        os.remove(self.journal_file)
+        fsync_directory(os.path.dirname(os.path.abspath(self.journal_file)))
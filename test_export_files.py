@@ -0,0 +1,188 @@
+import json
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+from reader import ExportReader
+from storage import ExportStore
+
+
+def txt_message(message_id, date_str, sender, text):
+    return f"MSGID: {message_id} | [{date_str}] (ID {sender}): {text}\n"
+
+
+def md_message(message_id, date_str, sender, text):
+    return (
+        f"### Message {message_id}\n"
+        f"**Date:** {date_str}  \n"
+        f"**Sender:** {sender}\n\n"
+        f"{text}\n\n"
+        f"---\n"
+    )
+
+
+def message_date(message_id):
+    return (datetime(2024, 1, 1) + timedelta(hours=message_id)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def message_text(message_id):
+    # Каждое пятое сообщение многострочное и содержит строки, похожие на заголовки.
+    if message_id % 5 == 0:
+        return f"text {message_id}\nMSGID: fake\n### Message 1"
+    return f"текст {message_id}"
+
+
+@pytest.fixture(params=[("txt", "\n"), ("txt", "\r\n"), ("md", "\n"), ("md", "\r\n")],
+                ids=["txt", "txt-crlf", "md", "md-crlf"])
+def export_file(request, tmp_path):
+    output_format, newline = request.param
+    render = md_message if output_format == "md" else txt_message
+    file_path = tmp_path / f"chat.{output_format}"
+    # Как и export_chat: новые сообщения в начале файла, id 2, 4, ..., 200.
+    with open(file_path, "w", encoding="utf-8", newline=newline) as f:
+        for message_id in range(200, 0, -2):
+            sender = "UnknownSender" if message_id % 3 == 0 else 42
+            f.write(render(message_id, message_date(message_id), sender, message_text(message_id)))
+    return str(file_path), output_format
+
+
+def test_detects_format_and_reads_ends(export_file):
+    file_path, output_format = export_file
+    with ExportReader(file_path) as reader:
+        assert reader.output_format == output_format
+        assert reader.first().id == 200
+        assert reader.last().id == 2
+        assert [m.id for m in reader] == list(range(200, 0, -2))
+
+
+def test_get_by_id(export_file):
+    file_path, _ = export_file
+    with ExportReader(file_path) as reader:
+        for message_id in (200, 100, 50, 2):
+            message = reader.get(message_id)
+            assert message.id == message_id
+            assert message.date == message_date(message_id)
+            assert message.text == message_text(message_id)
+        assert reader.get(99) is None
+        assert reader.get(202) is None
+        assert reader.get(0) is None
+        assert reader.get(30).sender == "UnknownSender"
+        assert reader.get(32).sender == "42"
+
+
+def test_iter_by_id_range(export_file):
+    file_path, _ = export_file
+    with ExportReader(file_path) as reader:
+        assert [m.id for m in reader.iter_messages(min_id=20, max_id=31)] == [30, 28, 26, 24, 22, 20]
+        assert [m.id for m in reader.iter_messages(min_id=197)] == [200, 198]
+        assert [m.id for m in reader.iter_messages(max_id=5)] == [4, 2]
+
+
+def test_iter_by_date_range(export_file):
+    file_path, _ = export_file
+    with ExportReader(file_path) as reader:
+        day = [m.id for m in reader.iter_messages(date_from="2024-01-03", date_to="2024-01-03")]
+        assert day == list(range(70, 46, -2))
+        assert [m.id for m in reader.iter_messages(date_to=date(2024, 1, 1))] == list(range(22, 0, -2))
+        moscow = timezone(timedelta(hours=3))
+        window = reader.iter_messages(
+            date_from=datetime(2024, 1, 1, 13, tzinfo=moscow),
+            date_to=datetime(2024, 1, 1, 17, tzinfo=moscow)
+        )
+        assert [m.id for m in window] == [14, 12, 10]
+
+
+def test_empty_file(tmp_path):
+    file_path = tmp_path / "empty.txt"
+    file_path.write_bytes(b"")
+    with ExportReader(str(file_path)) as reader:
+        assert reader.first() is None
+        assert reader.last() is None
+        assert reader.get(1) is None
+        assert list(reader) == []
+
+
+def read(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def test_commit_writes_files_and_state(tmp_path):
+    state_file = str(tmp_path / "state.json")
+    export = str(tmp_path / "chat.txt")
+    with open(export, "w", encoding="utf-8") as f:
+        f.write("old\n")
+    exported_chats = {"1": {"last_message_id": 1}}
+    store = ExportStore(state_file)
+    store.stage("1", export, "new\n", {"last_message_id": 2})
+    assert read(export) == "old\n"
+    assert exported_chats["1"]["last_message_id"] == 1
+    store.commit(exported_chats)
+    assert read(export) == "new\nold\n"
+    assert exported_chats["1"]["last_message_id"] == 2
+    assert json.loads(read(state_file)) == exported_chats
+    assert not (tmp_path / "state.json.journal").exists()
+    assert not (tmp_path / "chat.txt.tmp").exists()
+
+
+def test_failed_commit_keeps_live_state(tmp_path, monkeypatch):
+    export = str(tmp_path / "chat.txt")
+    exported_chats = {"1": {"last_message_id": 1}}
+    store = ExportStore(str(tmp_path / "state.json"))
+    store.stage("1", export, "new\n", {"last_message_id": 2})
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr("storage.json.dump", fail)
+    with pytest.raises(OSError):
+        store.commit(exported_chats)
+    assert exported_chats["1"]["last_message_id"] == 1
+    assert not (tmp_path / "chat.txt").exists()
+
+    monkeypatch.undo()
+    store.commit(exported_chats)
+    assert exported_chats["1"]["last_message_id"] == 2
+    assert read(export) == "new\n"
+
+
+def test_recover_applies_complete_journal(tmp_path):
+    state_file = str(tmp_path / "state.json")
+    export = str(tmp_path / "chat.txt")
+    with open(export, "w", encoding="utf-8") as f:
+        f.write("old\n")
+    # Сбой после записи журнала: один файл уже переименован, второй ещё нет.
+    with open(export + ".tmp", "w", encoding="utf-8") as f:
+        f.write("new\nold\n")
+    other = str(tmp_path / "other.txt")
+    with open(other, "w", encoding="utf-8") as f:
+        f.write("other new\n")
+    journal = {
+        "renames": [[export + ".tmp", export], [other + ".tmp", other]],
+        "state": {"1": {"last_message_id": 2}, "2": {"last_message_id": 5}}
+    }
+    with open(state_file + ".journal", "w", encoding="utf-8") as f:
+        json.dump(journal, f)
+
+    ExportStore(state_file).recover()
+    assert read(export) == "new\nold\n"
+    assert read(other) == "other new\n"
+    assert json.loads(read(state_file)) == journal["state"]
+    assert not (tmp_path / "state.json.journal").exists()
+
+
+def test_recover_discards_torn_journal(tmp_path):
+    state_file = str(tmp_path / "state.json")
+    export = str(tmp_path / "chat.txt")
+    with open(export, "w", encoding="utf-8") as f:
+        f.write("old\n")
+    with open(export + ".tmp", "w", encoding="utf-8") as f:
+        f.write("new\nold\n")
+    with open(state_file, "w", encoding="utf-8") as f:
+        json.dump({"1": {"last_message_id": 1}}, f)
+    with open(state_file + ".journal", "w", encoding="utf-8") as f:
+        f.write('{"renames": [["' + export)
+
+    ExportStore(state_file).recover()
+    assert read(export) == "old\n"
+    assert json.loads(read(state_file)) == {"1": {"last_message_id": 1}}
+    assert not (tmp_path / "state.json.journal").exists()